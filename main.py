@@ -1,17 +1,24 @@
 import streamlit as st
-import requests
 import json
-from datetime import datetime
+import hashlib
+import re
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-# Page configuration
-st.set_page_config(
-    page_title="Health Advice Chatbot",
-    page_icon="🏥",
-    layout="wide"
-)
+# orjson is an optional, much faster JSON codec for API payloads
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Custom CSS
-st.markdown("""
+# Default reply length; generation time grows roughly linearly with output tokens
+DEFAULT_MAX_TOKENS = 400
+
+# Static page markup kept as constants so reruns do no string building
+CSS_BLOCK = """
     <style>
     .main {
         padding: 2rem;
@@ -42,39 +49,333 @@ st.markdown("""
         margin-bottom: 1rem;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+DISCLAIMER_HTML = """
+<div class="disclaimer">
+    <strong>⚠️ Medical Disclaimer:</strong> This chatbot provides general health information only. 
+    It is NOT a substitute for professional medical advice, diagnosis, or treatment. 
+    Always consult with qualified healthcare providers for medical concerns.
+</div>
+"""
+
+SAMPLE_LEFT = """
+**Nutrition & Diet:**
+- What are some healthy breakfast options?
+- How much water should I drink daily?
+- What foods boost immune system?
+
+**Exercise & Fitness:**
+- What exercises are good for back pain?
+- How to start a workout routine?
+- Benefits of walking daily?
+"""
+
+SAMPLE_RIGHT = """
+**Mental Health:**
+- How can I reduce stress naturally?
+- What are the benefits of meditation?
+- Tips for better sleep quality?
+
+**General Wellness:**
+- How to maintain healthy weight?
+- Importance of regular checkups?
+- Ways to boost energy levels?
+"""
+
+FOOTER_TEMPLATE = """
+<div style="text-align: center; color: #666; padding: 1rem;">
+    <small>Built with Streamlit 🎈 | Powered by {provider_text} | Voice by Web Speech API 🔊<br>
+    For educational purposes only - Always consult healthcare professionals</small>
+</div>
+"""
+
+# Quick actions by URL-friendly slug: (label, prompt)
+QUICK_ACTIONS = {
+    "sleep": ("💤 Sleep Tips", "Give me tips for better sleep"),
+    "diet": ("🥗 Healthy Eating", "How to eat healthier?"),
+    "exercise": ("🏃 Exercise Guide", "What exercises should beginners do?"),
+    "stress": ("🧘 Stress Relief", "How to manage stress?")
+}
+
+# Chat bubble templates; blank lines let the message markdown render inside the div.
+# Message text goes through contain_markdown() first: the whole history is one element, so a
+# stray tag such as <pre or <!--, or an unclosed ``` fence, would otherwise swallow every
+# later message.
+USER_TEMPLATE = """<div class="chat-message user-message">
+
+**👤 You:**
+
+{content}
+
+</div>
+
+"""
+
+BOT_TEMPLATE = """<div class="chat-message bot-message">
+
+**🤖 Health Assistant #{number}:**
+
+{content}
+
+</div>
+
+"""
+
+FENCE_PATTERN = re.compile(r" {0,3}(`{3,}|~{3,})")
+CODE_SPAN_PATTERN = re.compile(r"(`+).+?\1")
+
+def contain_markdown(text):
+    """Escape raw HTML outside code and close an unterminated fence so text stays in its bubble"""
+    lines = []
+    fence = None
+    for line in text.split("\n"):
+        match = FENCE_PATTERN.match(line)
+        if fence is not None:
+            # A fence closes on a bare run of the same character at least as long
+            closing = match and not line[match.end():].strip()
+            if closing and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+        elif match:
+            fence = match.group(1)
+        else:
+            # Escape "<" only, leaving inline code spans as written
+            pos = 0
+            parts = []
+            for span in CODE_SPAN_PATTERN.finditer(line):
+                parts.append(line[pos:span.start()].replace("<", "&lt;"))
+                parts.append(span.group(0))
+                pos = span.end()
+            parts.append(line[pos:].replace("<", "&lt;"))
+            line = "".join(parts)
+        lines.append(line)
+    if fence is not None:
+        lines.append(fence)
+    return "\n".join(lines)
+
+SPEAK_BUTTONS_PER_ROW = 8
+SPEAK_BAR_ROW_HEIGHT = 44  # pixels
+
+def render_history(messages):
+    """Return the conversation HTML, assistant indices and speak bar, formatting only new messages"""
+    rendered = st.session_state.get("rendered_history")
+    if rendered is None or rendered["count"] > len(messages):
+        rendered = {"count": 0, "html": "", "bot_indices": [], "speak_bar": ""}
+    
+    if rendered["count"] == len(messages):
+        return rendered["html"], rendered["bot_indices"], rendered["speak_bar"]
+    
+    parts = [rendered["html"]]
+    for idx in range(rendered["count"], len(messages)):
+        message = messages[idx]
+        if message["role"] == "user":
+            parts.append(USER_TEMPLATE.format(content=contain_markdown(message["content"])))
+        else:
+            rendered["bot_indices"].append(idx)
+            parts.append(BOT_TEMPLATE.format(number=len(rendered["bot_indices"]), content=contain_markdown(message["content"])))
+    rendered["html"] = "".join(parts)
+    rendered["count"] = len(messages)
+    if rendered["bot_indices"]:
+        rendered["speak_bar"] = speak_bar_html(messages, rendered["bot_indices"])
+    
+    st.session_state.rendered_history = rendered
+    return rendered["html"], rendered["bot_indices"], rendered["speak_bar"]
+
+@st.cache_data(show_spinner=False)
+def footer_html(provider):
+    """Render the footer for the selected provider, memoized across reruns"""
+    provider_text = "Grok (xAI) 🚀" if provider == "Grok" else "DeepSeek AI 🤖"
+    return FOOTER_TEMPLATE.format(provider_text=provider_text)
+
+# Page configuration
+st.set_page_config(
+    page_title="Health Advice Chatbot",
+    page_icon="🏥",
+    layout="wide"
+)
+
+# Custom CSS
+st.markdown(CSS_BLOCK, unsafe_allow_html=True)
 
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if "summary" not in st.session_state:
+    st.session_state.summary = ""
+    st.session_state.summary_upto = 0
+
 if "api_key" not in st.session_state:
     st.session_state.api_key = ""
 
 if "voice_enabled" not in st.session_state:
     st.session_state.voice_enabled = False
 
+if "max_tokens" not in st.session_state:
+    st.session_state.max_tokens = DEFAULT_MAX_TOKENS
+
 if "api_provider" not in st.session_state:
     st.session_state.api_provider = "Grok"
 
-# Function to call Grok API
-def get_grok_response(messages, api_key):
-    """Call Grok API (xAI) to get health advice"""
-    
-    if not api_key or api_key.strip() == "":
-        return "❌ Error: API key is empty. Please enter a valid Grok API key in the sidebar."
+# The HTTP stack is imported in this one place, on first use
+def _http():
+    """Return the requests module, importing it when first needed"""
+    import requests
+    return requests
+
+MAX_CONCURRENT_REPLIES = 32  # sessions that can stream a reply at the same time
+
+# Shared HTTP session so consecutive turns reuse the same keep-alive TLS connection
+@st.cache_resource
+def _get_session():
+    """Create a pooled requests session shared across reruns and users"""
+    requests = _http()
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     
-    url = "https://api.x.ai/v1/chat/completions"
+    session = requests.Session()
+    # Retry refused connections and statuses that mean the request was not served, but never
+    # a read timeout or a 502/504 gateway error: the completion POST may already have been
+    # processed (and billed) upstream
+    retries = Retry(
+        total=2,
+        read=False,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 503],
+        allowed_methods=None,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_REPLIES, max_retries=retries)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+# Worker threads for API calls that should not hold up the current turn. Replies get their own
+# pool, sized for the sessions expected to wait on one at once, so summaries and warm-ups
+# never queue a user's answer behind them.
+@st.cache_resource
+def _get_reply_executor():
+    """Create the thread pool that streams replies, shared across reruns and users"""
+    return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REPLIES, thread_name_prefix="reply")
+
+@st.cache_resource
+def _get_executor():
+    """Create a small thread pool for background summaries and warm-ups"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="api")
+
+def dumps_json(obj, sort_keys=False):
+    """Serialize to compact JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode()
+
+def loads_json(data):
+    """Parse JSON text or bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Provider hosts, warmed up in the background so the first turn skips the TLS handshake
+API_HOSTS = {
+    "Grok": "https://api.x.ai",
+    "DeepSeek": "https://api.deepseek.com"
+}
+
+def warm_connection(provider):
+    """Open a pooled keep-alive connection to the provider ahead of the first request"""
+    errors = _http().exceptions
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key.strip()}"
-    }
+    try:
+        _get_session().head(API_HOSTS[provider], timeout=5)
+    except errors.RequestException:
+        pass
+
+# Model-list endpoints used to check a key without generating a completion
+MODELS_URLS = {
+    "Grok": "https://api.x.ai/v1/models",
+    "DeepSeek": "https://api.deepseek.com/models"
+}
+
+@st.cache_data(ttl=300, show_spinner=False)
+def validate_api_key(api_key, provider):
+    """Return whether the provider accepts the key, cached for five minutes per key"""
+    # Network failures raise instead of returning, so they are never cached
+    response = _get_session().get(
+        MODELS_URLS[provider],
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=10
+    )
+    if response.status_code in (401, 403):
+        return False
+    response.raise_for_status()
+    return True
+
+class ErrorText(str):
+    """A streamed chunk that reports a failure instead of carrying model output"""
+
+def join_reply(stream):
+    """Join a reply stream, returning (text, failed); on failure text is only the error message"""
+    parts = []
+    for chunk in stream:
+        if isinstance(chunk, ErrorText):
+            return chunk, True
+        parts.append(chunk)
+    return "".join(parts), False
+
+# Stream a chat completion as server-sent events, yielding text as it arrives
+def _stream_chat(url, headers, data, provider):
+    """POST a streaming chat completion and yield content deltas"""
+    errors = _http().exceptions
     
-    # Add system prompt for health advice
-    system_message = {
-        "role": "system",
-        "content": """You are a helpful health advice assistant. Provide general health information, wellness tips, and lifestyle advice. 
+    try:
+        response = _get_session().post(url, headers=headers, data=dumps_json(data), timeout=60, stream=True)
+        
+        with response:
+            # Check for specific error codes
+            if response.status_code == 401:
+                yield ErrorText(f"❌ Authentication Error: Invalid API key. Please check your {provider} API key.")
+                return
+            elif response.status_code == 429:
+                yield ErrorText("⚠️ Rate Limit: Too many requests. Please wait a moment and try again.")
+                return
+            elif response.status_code == 500:
+                yield ErrorText(f"❌ Server Error: {provider} API is experiencing issues. Please try again later.")
+                return
+            
+            response.raise_for_status()
+            
+            # SSE is always UTF-8; without a charset requests would fall back to ISO-8859-1
+            response.encoding = "utf-8"
+            received = False
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = loads_json(payload)
+                if chunk.get("choices"):
+                    content = chunk["choices"][0]["delta"].get("content") or ""
+                    if content:
+                        received = True
+                        yield content
+        
+        if not received:
+            yield ErrorText("❌ Error: Unexpected response format from API.")
+            
+    except errors.Timeout:
+        yield ErrorText("⏱️ Timeout Error: Request took too long. Please try again.")
+    except errors.ConnectionError:
+        yield ErrorText(f"🌐 Connection Error: Unable to connect to {provider} API. Check your internet connection.")
+    except errors.RequestException as e:
+        yield ErrorText(f"❌ Request Error: {str(e)}")
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        yield ErrorText(f"❌ Parse Error: Unable to parse API response - {str(e)}")
+
+# System prompt for health advice, shared by every provider call
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """You are a helpful health advice assistant. Provide general health information, wellness tips, and lifestyle advice. 
 
 IMPORTANT DISCLAIMERS:
 - You are NOT a replacement for professional medical advice
@@ -84,52 +385,40 @@ IMPORTANT DISCLAIMERS:
 - If someone describes serious symptoms, urge them to seek immediate medical attention
 
 Be empathetic, informative, and always prioritize user safety. Keep responses concise and clear."""
-    }
+}
+
+# Function to call Grok API
+def get_grok_response(messages, api_key, max_tokens=DEFAULT_MAX_TOKENS):
+    """Call Grok API (xAI) to stream health advice"""
     
-    full_messages = [system_message] + messages
+    if not api_key or api_key.strip() == "":
+        yield ErrorText("❌ Error: API key is empty. Please enter a valid Grok API key in the sidebar.")
+        return
+    
+    url = "https://api.x.ai/v1/chat/completions"
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key.strip()}"
+    }
     
     data = {
         "model": "grok-beta",
-        "messages": full_messages,
+        "messages": [SYSTEM_MESSAGE, *messages],
         "temperature": 0.7,
-        "max_tokens": 1000,
-        "stream": False
+        "max_tokens": max_tokens,
+        "stream": True
     }
     
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        
-        # Check for specific error codes
-        if response.status_code == 401:
-            return "❌ Authentication Error: Invalid API key. Please check your Grok API key and make sure it's correct."
-        elif response.status_code == 429:
-            return "⚠️ Rate Limit: Too many requests. Please wait a moment and try again."
-        elif response.status_code == 500:
-            return "❌ Server Error: Grok API is experiencing issues. Please try again later."
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        if 'choices' in result and len(result['choices']) > 0:
-            return result['choices'][0]['message']['content']
-        else:
-            return "❌ Error: Unexpected response format from API."
-            
-    except requests.exceptions.Timeout:
-        return "⏱️ Timeout Error: Request took too long. Please try again."
-    except requests.exceptions.ConnectionError:
-        return "🌐 Connection Error: Unable to connect to Grok API. Check your internet connection."
-    except requests.exceptions.RequestException as e:
-        return f"❌ Request Error: {str(e)}"
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        return f"❌ Parse Error: Unable to parse API response - {str(e)}"
+    yield from _stream_chat(url, headers, data, "Grok")
 
 # Function to call DeepSeek API (alternative)
-def get_deepseek_response(messages, api_key):
-    """Call DeepSeek API as alternative provider"""
+def get_deepseek_response(messages, api_key, max_tokens=DEFAULT_MAX_TOKENS):
+    """Call DeepSeek API as alternative provider, streaming the reply"""
     
     if not api_key or api_key.strip() == "":
-        return "❌ Error: API key is empty. Please enter a valid DeepSeek API key in the sidebar."
+        yield ErrorText("❌ Error: API key is empty. Please enter a valid DeepSeek API key in the sidebar.")
+        return
     
     url = "https://api.deepseek.com/chat/completions"
     
@@ -138,87 +427,301 @@ def get_deepseek_response(messages, api_key):
         "Authorization": f"Bearer {api_key.strip()}"
     }
     
-    system_message = {
-        "role": "system",
-        "content": """You are a helpful health advice assistant. Provide general health information, wellness tips, and lifestyle advice. 
-
-IMPORTANT DISCLAIMERS:
-- You are NOT a replacement for professional medical advice
-- Always remind users to consult healthcare professionals for diagnosis and treatment
-- Do not provide specific diagnoses or prescribe medications
-- Focus on general wellness, preventive care, and healthy lifestyle tips
-- If someone describes serious symptoms, urge them to seek immediate medical attention
-
-Be empathetic, informative, and always prioritize user safety. Keep responses concise and clear."""
-    }
-    
-    full_messages = [system_message] + messages
-    
     data = {
         "model": "deepseek-chat",
-        "messages": full_messages,
+        "messages": [SYSTEM_MESSAGE, *messages],
         "temperature": 0.7,
-        "max_tokens": 1000,
-        "stream": False
+        "max_tokens": max_tokens,
+        "stream": True
     }
     
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        
-        if response.status_code == 401:
-            return "❌ Authentication Error: Invalid API key. Please check your DeepSeek API key."
-        elif response.status_code == 429:
-            return "⚠️ Rate Limit: Too many requests. Please wait a moment and try again."
-        elif response.status_code == 500:
-            return "❌ Server Error: DeepSeek API is experiencing issues. Please try again later."
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        if 'choices' in result and len(result['choices']) > 0:
-            return result['choices'][0]['message']['content']
-        else:
-            return "❌ Error: Unexpected response format from API."
-            
-    except requests.exceptions.Timeout:
-        return "⏱️ Timeout Error: Request took too long. Please try again."
-    except requests.exceptions.ConnectionError:
-        return "🌐 Connection Error: Unable to connect to DeepSeek API. Check your internet connection."
-    except requests.exceptions.RequestException as e:
-        return f"❌ Request Error: {str(e)}"
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        return f"❌ Parse Error: Unable to parse API response - {str(e)}"
+    yield from _stream_chat(url, headers, data, "DeepSeek")
 
 # Function to get AI response based on selected provider
-def get_ai_response(messages, api_key, provider):
-    """Route to appropriate API based on provider selection"""
+def get_ai_response(messages, api_key, provider, max_tokens=DEFAULT_MAX_TOKENS):
+    """Route to appropriate API based on provider selection, yielding text chunks"""
     if provider == "Grok":
-        return get_grok_response(messages, api_key)
+        yield from get_grok_response(messages, api_key, max_tokens)
     elif provider == "DeepSeek":
-        return get_deepseek_response(messages, api_key)
+        yield from get_deepseek_response(messages, api_key, max_tokens)
     else:
-        return "❌ Error: Unknown API provider selected."
+        yield ErrorText("❌ Error: Unknown API provider selected.")
+
+# Conversation history limits for each API call
+HISTORY_WINDOW = 16  # last 8 user/assistant pairs are always sent verbatim
+CONTEXT_TOKEN_BUDGET = 3000
+SUMMARY_BLOCK = 8  # messages folded into the summary ahead of the window on each refresh
+ERROR_PREFIXES = ("❌", "⚠️", "⏱️", "🌐")
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) without a tokenizer"""
+    return len(text) // 4
+
+def summarize_history(messages, previous_summary, api_key, provider, upto):
+    """Condense older turns (and any earlier summary) into a short recap"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = (
+        "Summarize this health conversation in under 100 words, keeping any "
+        "symptoms, conditions, goals and advice already given.\n\n"
+        f"Earlier summary: {previous_summary or 'none'}\n\n{transcript}"
+    )
+    summary, failed = join_reply(get_ai_response([{"role": "user", "content": prompt}], api_key, provider))
+    return (None if failed else summary), upto
+
+def build_context(messages, api_key, provider):
+    """Return the messages to send: a summary of older turns plus a recent window"""
+    # Pick up a summary finished in the background since the last turn
+    pending = st.session_state.get("summary_future")
+    if pending is not None and pending.done():
+        del st.session_state.summary_future
+        summary, upto = pending.result()
+        if summary is not None:
+            st.session_state.summary = summary
+            st.session_state.summary_upto = upto
+        pending = None
+    
+    # Newest messages that fit in the token budget and the window, never reaching back past the summary
+    upto = st.session_state.summary_upto
+    floor = max(upto, len(messages) - HISTORY_WINDOW)
+    budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(st.session_state.summary)
+    start = len(messages)
+    while start > floor:
+        budget -= estimate_tokens(messages[start - 1]["content"])
+        if budget < 0 and start < len(messages):
+            break
+        start -= 1
+    start += start % 2  # begin the window on a user turn
+    
+    # Every turn left out of the window must be summarized. The refresh runs alongside this
+    # turn's request and also folds in the next block of turns still in the window, so it is
+    # only needed every few turns rather than on every one.
+    if pending is None and start > upto:
+        limit = len(messages) - 3  # keep the last exchange and the new question verbatim
+        limit -= limit % 2  # keep user/assistant pairs together
+        cutoff = max(start, min(start + SUMMARY_BLOCK, limit))
+        st.session_state.summary_future = _get_executor().submit(
+            summarize_history,
+            messages[upto:cutoff],
+            st.session_state.summary,
+            api_key,
+            provider,
+            cutoff
+        )
+    
+    recent = messages[start:]
+    if st.session_state.summary:
+        recent.insert(0, {"role": "system", "content": "Conversation so far: " + st.session_state.summary})
+    return recent
+
+# Answer cache so repeated prompts (e.g. quick actions) skip the API round-trip
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 3600  # seconds
+
+@st.cache_resource
+def _get_response_cache():
+    """Process-wide LRU of answers shared across reruns and sessions"""
+    return OrderedDict(), threading.Lock()
+
+def response_cache_key(messages, api_key, provider, max_tokens):
+    """Hash the provider, API key, length limit and exact messages into a cache key"""
+    payload = dumps_json({
+        "provider": provider,
+        "max_tokens": max_tokens,
+        "api_key": hashlib.sha256(api_key.encode()).hexdigest(),
+        "messages": messages
+    }, sort_keys=True)
+    return hashlib.sha256(payload).hexdigest()
+
+def get_cached_response(key):
+    """Return a cached answer that has not expired, or None"""
+    cache, lock = _get_response_cache()
+    with lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        stored_at, text = entry
+        if time.time() - stored_at > RESPONSE_CACHE_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return text
+
+def store_cached_response(key, text):
+    """Remember a successful answer, evicting the least recently used"""
+    if not text:
+        return
+    cache, lock = _get_response_cache()
+    with lock:
+        cache[key] = (time.time(), text)
+        cache.move_to_end(key)
+        while len(cache) > RESPONSE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+# Browser speech helpers shared by auto-speak and the speak bar. Utterances are cached
+# on the parent page, keyed by text hash, so they outlive each component iframe.
+TTS_SCRIPT = """
+<script>
+function speechHost() {
+    try {
+        if (window.parent.speechSynthesis) return window.parent;
+    } catch (e) {}
+    return window;
+}
+function speakCached(key, sentences) {
+    const host = speechHost();
+    host.__ttsCache = host.__ttsCache || new Map();
+    if (!host.__ttsCache.has(key) && sentences.length) {
+        host.__ttsCache.set(key, sentences.map((sentence) => {
+            const utterance = new host.SpeechSynthesisUtterance(sentence);
+            utterance.rate = 0.9;
+            utterance.pitch = 1;
+            utterance.volume = 1;
+            return utterance;
+        }));
+    }
+    for (const utterance of host.__ttsCache.get(key) || []) {
+        host.speechSynthesis.speak(utterance);
+    }
+}
+</script>
+"""
+
+def js_literal(obj):
+    """Encode a value as a JS literal that cannot close the surrounding script tag"""
+    return json.dumps(obj).replace("</", "<\\/")
+
+def speech_key(text):
+    """Key the browser utterance cache by a hash of the text"""
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def speech_sentences(text):
+    """Strip markdown markers and split into sentences so speech starts on the first one"""
+    clean_text = text.replace('`', '').replace('*', '')
+    return [part for part in re.split(r'(?<=[.!?])\s+', clean_text) if part.strip()]
 
 # Function to convert text to speech using browser TTS
 def text_to_speech(text):
-    """Generate speech from text using JavaScript"""
-    # Clean text for speech
-    clean_text = text.replace('"', '\\"').replace('\n', ' ').replace('`', '').replace('*', '')
+    """Generate speech from text using JavaScript, reusing utterances the browser already has"""
+    key = speech_key(text)
+    sent = st.session_state.setdefault("tts_sent", set())
     
-    js_code = f"""
-    <script>
-    function speak() {{
-        const text = `{clean_text}`;
-        const utterance = new SpeechSynthesisUtterance(text);
-        utterance.rate = 0.9;
-        utterance.pitch = 1;
-        utterance.volume = 1;
-        window.speechSynthesis.speak(utterance);
+    if key in sent:
+        # The page already holds utterances for this text; only the key is needed
+        sentences = []
+    else:
+        sentences = speech_sentences(text)
+        sent.add(key)
+    
+    return TTS_SCRIPT + f'<script>speakCached("{key}", {js_literal(sentences)});</script>'
+
+def speak_bar_html(messages, bot_indices):
+    """Build one component with a speak button per reply and a single delegated click handler"""
+    texts = {}
+    buttons = []
+    for number, idx in enumerate(bot_indices, start=1):
+        content = messages[idx]["content"]
+        key = speech_key(content)
+        texts[key] = speech_sentences(content)
+        buttons.append(f'<button data-key="{key}" title="Speak response #{number}">🔊 #{number}</button>')
+    
+    columns = min(len(bot_indices), SPEAK_BUTTONS_PER_ROW)
+    return TTS_SCRIPT + f"""
+    <style>
+    body {{ margin: 0; font-family: sans-serif; }}
+    .speak-bar {{ display: grid; grid-template-columns: repeat({columns}, 1fr); gap: 0.5rem; }}
+    .speak-bar button {{
+        padding: 0.35rem;
+        border: 1px solid #ddd;
+        border-radius: 0.5rem;
+        background-color: #fff;
+        cursor: pointer;
     }}
-    speak();
+    </style>
+    <div class="speak-bar">{"".join(buttons)}</div>
+    <script>
+    const texts = {js_literal(texts)};
+    document.querySelector(".speak-bar").addEventListener("click", (event) => {{
+        const button = event.target.closest("button[data-key]");
+        if (button) speakCached(button.dataset.key, texts[button.dataset.key]);
+    }});
     </script>
     """
-    return js_code
+
+# Inline HTML components use st.iframe where available; st.components.v1.html is deprecated
+def embed_html(markup, height=None):
+    """Embed trusted app-generated HTML, sized to its content when no height is given"""
+    if hasattr(st, "iframe"):
+        st.iframe(markup, height=height or "content")
+    else:
+        st.components.v1.html(markup, height=height or 0)
+
+# Run a reply on the worker pool; the script thread only polls its queue, touching the page while
+# it waits so a sidebar interaction can still interrupt the run (see drain_reply)
+REPLY_POLL_INTERVAL = 0.25  # seconds
+
+def _produce_reply(chunks, messages, api_key, provider, max_tokens, cache_key):
+    """Worker: stream the reply into a queue and return the full text, or only the error on failure"""
+    def forward(stream):
+        for chunk in stream:
+            chunks.put(chunk)
+            yield chunk
+    
+    try:
+        reply, failed = join_reply(forward(get_ai_response(messages, api_key, provider, max_tokens)))
+    except Exception as e:
+        # Anything unexpected becomes an error reply instead of surfacing from future.result()
+        reply, failed = ErrorText(f"❌ Error: Unexpected failure while getting a reply - {str(e)}"), True
+        chunks.put(reply)
+    finally:
+        chunks.put(None)
+    # A reply cut short by an error is neither cached nor kept as a normal answer
+    if not failed:
+        store_cached_response(cache_key, reply)
+    return reply
+
+def drain_reply(chunks, status):
+    """Yield chunks produced by a background reply until it signals the end"""
+    # Streamlit only stops a run inside st.* calls, so every idle poll updates the status placeholder
+    dots = 0
+    started = False
+    while True:
+        try:
+            chunk = chunks.get(timeout=REPLY_POLL_INTERVAL)
+        except queue.Empty:
+            dots = dots % 3 + 1
+            status.markdown("🤔 Thinking" + "." * dots)
+            continue
+        if not started:
+            started = True
+            status.empty()
+        if chunk is None:
+            return
+        yield chunk
+
+@st.fragment(run_every=0.5)
+def show_pending_reply():
+    """Poll a reply whose run was interrupted, without blocking the rest of the page"""
+    future = st.session_state.get("pending_reply")
+    if future is None:
+        return
+    if not future.done():
+        st.markdown("**🤖 Health Assistant:** 🤔 Thinking...")
+        return
+    del st.session_state.pending_reply
+    st.session_state.messages.append({"role": "assistant", "content": future.result()})
+    st.rerun()
+
+# Queue a canned prompt so it is answered by the regular chat input path
+def queue_prompt(prompt):
+    """Button callback that hands a quick-action prompt to the chat handler"""
+    st.session_state.pending_prompt = prompt
+
+def queue_quick_action():
+    """Pills callback that queues the chosen quick action and clears the selection"""
+    slug = st.session_state.quick_action
+    if slug in QUICK_ACTIONS:
+        queue_prompt(QUICK_ACTIONS[slug][1])
+    st.session_state.quick_action = None
 
 # Sidebar for API key and settings
 with st.sidebar:
@@ -256,6 +759,10 @@ with st.sidebar:
     if api_key_input:
         st.session_state.api_key = api_key_input.strip()
         st.success("✅ API Key saved")
+        
+        if st.session_state.get("warmed_provider") != api_provider:
+            _get_executor().submit(warm_connection, api_provider)
+            st.session_state.warmed_provider = api_provider
     else:
         st.warning("⚠️ Please enter your API key")
     
@@ -270,6 +777,18 @@ with st.sidebar:
     
     st.markdown("---")
     
+    st.markdown("### 📝 Response Settings")
+    st.session_state.max_tokens = st.slider(
+        "Response length (tokens)",
+        min_value=100,
+        max_value=1500,
+        value=st.session_state.max_tokens,
+        step=50,
+        help="Shorter limits return answers faster"
+    )
+    
+    st.markdown("---")
+    
     st.markdown("### 📋 Get API Key:")
     
     if api_provider == "Grok":
@@ -300,156 +819,164 @@ with st.sidebar:
     
     if st.button("🗑️ Clear Chat History", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.summary = ""
+        st.session_state.summary_upto = 0
+        st.session_state.pop("summary_future", None)
+        st.session_state.pop("pending_reply", None)
+        st.session_state.pop("rendered_history", None)
+        st.session_state.pop("last_spoken", None)
         st.rerun()
     
     st.markdown("---")
     st.markdown("### 📊 Statistics")
-    st.metric("Messages", len(st.session_state.messages))
-    st.metric("Provider", api_provider)
+    # Filled in after the chat handler so the counts include this run's turn
+    stats_placeholder = st.empty()
     
     st.markdown("---")
     st.markdown("### 🧪 Test API Connection")
     if st.button("Test Connection", use_container_width=True):
         if st.session_state.api_key:
-            with st.spinner("Testing..."):
-                test_msg = [{"role": "user", "content": "Say 'API connection successful' in 5 words or less"}]
-                response = get_ai_response(test_msg, st.session_state.api_key, api_provider)
-                if "❌" in response or "Error" in response:
-                    st.error(response)
-                else:
+            try:
+                with st.spinner("Testing..."):
+                    valid = validate_api_key(st.session_state.api_key, api_provider)
+            except _http().exceptions.RequestException as e:
+                st.error(f"🌐 Connection Error: Unable to reach {api_provider} API - {str(e)}")
+            else:
+                if valid:
                     st.success("✅ Connection successful!")
-                    st.info(response)
+                else:
+                    st.error(f"❌ Authentication Error: Invalid API key. Please check your {api_provider} API key.")
         else:
             st.error("Please enter API key first")
 
+# Deep links such as ?q=sleep ask a quick action; the link waits in the URL until a key is entered.
+# Checked after the sidebar so it fires on the same rerun that stores the key.
+if "q" in st.query_params and st.session_state.api_key:
+    slug = st.query_params["q"]
+    del st.query_params["q"]
+    if slug in QUICK_ACTIONS:
+        queue_prompt(QUICK_ACTIONS[slug][1])
+
 # Main content
 st.title("🏥 Health Advice Chatbot")
 st.markdown(f"*Powered by {st.session_state.api_provider} AI with Voice Support*")
 
 # Disclaimer
-st.markdown("""
-<div class="disclaimer">
-    <strong>⚠️ Medical Disclaimer:</strong> This chatbot provides general health information only. 
-    It is NOT a substitute for professional medical advice, diagnosis, or treatment. 
-    Always consult with qualified healthcare providers for medical concerns.
-</div>
-""", unsafe_allow_html=True)
+st.markdown(DISCLAIMER_HTML, unsafe_allow_html=True)
 
-# Display chat messages
+# Display chat messages as a single markdown element
 chat_container = st.container()
 with chat_container:
-    for idx, message in enumerate(st.session_state.messages):
-        role = message["role"]
-        content = message["content"]
-        
-        if role == "user":
-            st.markdown(f"""
-            <div class="chat-message user-message">
-                <strong>👤 You:</strong><br>{content}
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            col1, col2 = st.columns([0.95, 0.05])
-            with col1:
-                st.markdown(f"""
-                <div class="chat-message bot-message">
-                    <strong>🤖 Health Assistant:</strong><br>{content}
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col2:
-                # Add speak button for each bot message
-                if st.button("🔊", key=f"speak_{idx}", help="Speak this response"):
-                    st.components.v1.html(text_to_speech(content), height=0)
+    history_html, _, _ = render_history(st.session_state.messages)
+    st.markdown(history_html, unsafe_allow_html=True)
 
 # Chat input
 if st.session_state.api_key:
-    user_input = st.chat_input("Ask about health, wellness, nutrition, exercise, or general medical information...")
+    # A reply left running by an interrupted rerun is finished by the polling fragment
+    # The input stays enabled while a reply is pending: Streamlit discards whatever is sent
+    # to a disabled widget, so a question typed during a slow reply would be lost.
+    waiting = "pending_reply" in st.session_state
+    user_input = st.chat_input(
+        "Ask about health, wellness, nutrition, exercise, or general medical information..."
+    )
+    
+    # Quick actions queue their prompt through a callback so they share this path.
+    # Always take the queued prompt so it can never fire on a later rerun.
+    queued_prompt = st.session_state.pop("pending_prompt", None)
+    if waiting:
+        # A question sent while a reply was still streaming is asked once that reply lands
+        if user_input or queued_prompt:
+            st.session_state.pending_prompt = user_input or queued_prompt
+        prompt = None
+        with chat_container:
+            show_pending_reply()
+    else:
+        prompt = user_input or queued_prompt
     
-    if user_input:
+    if prompt:
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": user_input})
+        st.session_state.messages.append({"role": "user", "content": prompt})
         
-        # Get bot response
-        with st.spinner("🤔 Thinking..."):
-            bot_response = get_ai_response(
+        with chat_container:
+            st.markdown(USER_TEMPLATE.format(content=contain_markdown(prompt)), unsafe_allow_html=True)
+            
+            # Stream bot response as it is generated; it joins the history block on the next rerun
+            st.markdown("**🤖 Health Assistant:**")
+            context = build_context(
                 st.session_state.messages,
                 st.session_state.api_key,
                 st.session_state.api_provider
             )
+            cache_key = response_cache_key(
+                context,
+                st.session_state.api_key,
+                st.session_state.api_provider,
+                st.session_state.max_tokens
+            )
+            bot_response = get_cached_response(cache_key)
+            if bot_response is not None:
+                st.markdown(bot_response)
+            else:
+                chunks = queue.Queue()
+                st.session_state.pending_reply = _get_reply_executor().submit(
+                    _produce_reply,
+                    chunks,
+                    context,
+                    st.session_state.api_key,
+                    st.session_state.api_provider,
+                    st.session_state.max_tokens,
+                    cache_key
+                )
+                st.write_stream(drain_reply(chunks, st.empty()))
+                bot_response = st.session_state.pop("pending_reply").result()
         
         # Add bot message
         st.session_state.messages.append({"role": "assistant", "content": bot_response})
-        
-        # Auto-speak if voice is enabled
-        if st.session_state.voice_enabled and not bot_response.startswith("❌"):
-            st.components.v1.html(text_to_speech(bot_response), height=0)
-        
-        # Rerun to display new messages
-        st.rerun()
+    
+    # Auto-speak each new reply exactly once, including ones finished by the polling fragment.
+    # Replies that arrive while voice is off are marked handled so enabling it later stays quiet.
+    messages = st.session_state.messages
+    if messages and messages[-1]["role"] == "assistant" and st.session_state.get("last_spoken") != len(messages):
+        st.session_state.last_spoken = len(messages)
+        if st.session_state.voice_enabled and not messages[-1]["content"].startswith(ERROR_PREFIXES):
+            embed_html(text_to_speech(messages[-1]["content"]))
 else:
     st.info(f"👈 Please enter your {st.session_state.api_provider} API key in the sidebar to start chatting")
 
+# Speak bar and statistics are drawn after the chat handler so they include this run's reply
+_, bot_indices, speak_bar = render_history(st.session_state.messages)
+if bot_indices:
+    # One component holds every speak button; clicks are handled in the browser
+    rows = -(-len(bot_indices) // SPEAK_BUTTONS_PER_ROW)
+    with chat_container:
+        embed_html(speak_bar, height=rows * SPEAK_BAR_ROW_HEIGHT)
+
+with stats_placeholder.container():
+    st.metric("Messages", len(st.session_state.messages))
+    st.metric("Provider", api_provider)
+
 # Sample questions
 with st.expander("💡 Sample Questions You Can Ask"):
     col1, col2 = st.columns(2)
     
     with col1:
-        st.markdown("""
-        **Nutrition & Diet:**
-        - What are some healthy breakfast options?
-        - How much water should I drink daily?
-        - What foods boost immune system?
-        
-        **Exercise & Fitness:**
-        - What exercises are good for back pain?
-        - How to start a workout routine?
-        - Benefits of walking daily?
-        """)
+        st.markdown(SAMPLE_LEFT)
     
     with col2:
-        st.markdown("""
-        **Mental Health:**
-        - How can I reduce stress naturally?
-        - What are the benefits of meditation?
-        - Tips for better sleep quality?
-        
-        **General Wellness:**
-        - How to maintain healthy weight?
-        - Importance of regular checkups?
-        - Ways to boost energy levels?
-        """)
+        st.markdown(SAMPLE_RIGHT)
 
-# Quick action buttons
+# Quick actions as a single pills widget
 st.markdown("### 🎯 Quick Actions")
-col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    if st.button("💤 Sleep Tips", use_container_width=True):
-        st.session_state.messages.append({"role": "user", "content": "Give me tips for better sleep"})
-        st.rerun()
-
-with col2:
-    if st.button("🥗 Healthy Eating", use_container_width=True):
-        st.session_state.messages.append({"role": "user", "content": "How to eat healthier?"})
-        st.rerun()
-
-with col3:
-    if st.button("🏃 Exercise Guide", use_container_width=True):
-        st.session_state.messages.append({"role": "user", "content": "What exercises should beginners do?"})
-        st.rerun()
-
-with col4:
-    if st.button("🧘 Stress Relief", use_container_width=True):
-        st.session_state.messages.append({"role": "user", "content": "How to manage stress?"})
-        st.rerun()
+st.pills(
+    "Quick Actions",
+    list(QUICK_ACTIONS),
+    format_func=lambda slug: QUICK_ACTIONS[slug][0],
+    key="quick_action",
+    on_change=queue_quick_action,
+    disabled=not st.session_state.api_key or "pending_reply" in st.session_state,
+    label_visibility="collapsed"
+)
 
 # Footer
 st.markdown("---")
-provider_text = "Grok (xAI) 🚀" if st.session_state.api_provider == "Grok" else "DeepSeek AI 🤖"
-st.markdown(f"""
-<div style="text-align: center; color: #666; padding: 1rem;">
-    <small>Built with Streamlit 🎈 | Powered by {provider_text} | Voice by Web Speech API 🔊<br>
-    For educational purposes only - Always consult healthcare professionals</small>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(footer_html(st.session_state.api_provider), unsafe_allow_html=True)